@@ -1,6 +1,20 @@
 import argparse
+import contextlib
+import difflib
+import hashlib
+import io
+import json
+import os
 import shutil
 import pathlib
+import sqlite3
+import sys
+import tarfile
+import time
+import zipfile
+
+import converter_core
+from converter_core import convert_source
 
 
 def setup_parser():
@@ -47,10 +61,76 @@ def setup_parser():
         default="skip",
         help="The new syntax must have a getter method before using a setter or deleter method. If a getter method does not exist for that property, you must either keep the old syntax (`skip`) or create an empty getter method (`convert`). Default: skip",
     )
+    parser.add_argument(
+        "--output_archive",
+        "-a",
+        type=str,
+        default=None,
+        help="Path of a .tar, .tar.gz, .tgz or .zip file. Write the output files into this single archive instead of the output folder.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="I/N. Convert only the files assigned to shard I of N (1 <= I <= N). Files are assigned by a hash of their path relative to the input folder, so every machine makes the same split.",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path of a JSON file to save the modified files, skipped properties and file counts of this run.",
+    )
+    parser.add_argument(
+        "--merge_reports",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Paths of JSON reports from --report. Print their combined summary instead of converting a folder.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse converted files from earlier runs when the file contents and options are the same. Useful with many checkouts of one project.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Folder of the cache used by --cache. Default: `property_converter` in $XDG_CACHE_HOME or ~/.cache",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=500,
+        help="Size limit of the cache in MB. The least recently used files are removed first. Default: 500",
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="Answer line-delimited JSON-RPC requests on stdin/stdout instead of converting a folder. Methods: convert_source, check, convert_file, shutdown.",
+    )
 
     return parser.parse_args()
 
 
+def get_default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(cache_home) / "property_converter"
+
+
+def parse_shard(val):
+    """Convert `I/N` to (I, N)"""
+    try:
+        index, count = (int(part) for part in val.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard {val!r}, expected I/N")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            f"invalid shard {val!r}, I must be from 1 to N"
+        )
+    return index, count
+
+
 def strtobool(val):
     """Convert a string representation of truth to true (1) or false (0).
     True values are 'y', 'yes', 't', 'true', 'on', and '1'; false values
@@ -66,349 +146,393 @@ def strtobool(val):
         raise ValueError("invalid truth value %r" % (val,))
 
 
-class IndentTracker:
-    """All code in a property block must have its indent reduced by 1 when converting."""
-
-    prev_indent = ""
-    current_indent = ""
-    one_indent = ""
-    property_indent = ""
-    property_name = ""
-    pause_insertions = False  # Prevent newlines immediately after property decorator
-    property_detect = ""  # Move docstrings only if immediately after property decorator
-    get_detect = False  # Prevent setter and deleter methods if getter doesn't exist
-
-    def update_indent(line):
-        if not line.strip():
-            return
-
-        Docstring.update_property_detect()
-
-        IndentTracker.current_indent = get_indent(line)
-
-        # Increase detected
-        if len(IndentTracker.current_indent) > len(IndentTracker.prev_indent):
-
-            # First indent detected
-            if len(IndentTracker.prev_indent) == 0:
-                IndentTracker.one_indent = IndentTracker.current_indent
-
-        # End of property block detected
-        if len(IndentTracker.current_indent) <= len(IndentTracker.property_indent):
-            IndentTracker.property_name = ""
-            IndentTracker.pause_insertions = False
-            IndentTracker.get_detect = False
-
-        # Always set prev to current
-        IndentTracker.prev_indent = IndentTracker.current_indent
-
-    def prevent_mixed_chars(line):
-        """Prevent use of mixed spaces and tabs in an indent"""
-        indent = get_indent(line)
-        if " " in indent and "\t" in indent:
-            print(f"ERROR mixed indent on line number {line_number}: {repr(line)}")
-            print(f"\n An indent must not contain both tabs and spaces.\n")
-            raise SystemExit
-
-        if len(indent) > 0 and len(IndentTracker.property_indent) > 0:
-            if indent[0] != IndentTracker.property_indent[0]:
-                print()
-                # print(3333333333, " ".join(str(ord(char)) for char in indent))
-
-
-class Docstring:
-    """A docstring for a property must be saved and moved to after a def statement"""
-
-    ONELINER_PREFIXES = (
-        "if ",
-        "elif ",
-        "else",
-        "for ",
-        "while ",
-        "def ",
-        "cdef ",
-        "cpdef ",
-        "class ",
-        "try",
-        "except",
-        "finally",
-    )  # all one-liners must start with one of these
-    DELIM_CHARS = ("'''", '"""', "'", '"', "#")
-
-    text = ""
-    descriptor = ""
-    delim_char = None
-
-    def new_docstring_detected(line):
-        Docstring.text = line
-
-        ## change to line.strip()[:3]?
-        # Set quote style
-        for delim_char in Docstring.DELIM_CHARS:
-            if line.strip().startswith(delim_char):
-                Docstring.delim_char = delim_char
-                break
-        else:
-            print("ERROR docstring", line)
-
-        ## change to line.strip().endswith(Docstring.delim_char)?
-        # One line docstring
-        if line.count(Docstring.delim_char) > 1 or delim_char == "#":
-            Docstring.descriptor = "INSERT"
-        # Begin multi line docstring
-        else:
-            Docstring.descriptor = "MULTI_LINE_IN_PROGRESS"
-
-    def insert_docstring(line):
-        if Docstring.descriptor != "INSERT":
-            return line
-
-        modified_line = "\n".join((line, Docstring.text))
-
-        Docstring.text = ""
-        Docstring.descriptor = ""
-        return modified_line
-
-    def build_multi_line(line):
-        """Combine all docstring lines. Return True while collecting multiline docstring"""
-        if Docstring.descriptor == "MULTI_LINE_IN_PROGRESS":
-            Docstring.text = "\n".join((Docstring.text, line))
-            if line.strip().endswith(Docstring.delim_char):
-                Docstring.descriptor = "INSERT"
-            return True
-
-    def update_property_detect():
-        "Detect the line after the property keyword"
-        if IndentTracker.property_detect == "CURRENT_LINE":
-            IndentTracker.property_detect = "LINE_AFTER"
-        else:
-            IndentTracker.property_detect = ""
-
-    def split_inline(line):
-        """Must split combined one line statements when trying to insert a doctstring.
-        Example: `def __get__(self): return self.index`
-
-        Only split the line when all true:
-        inside a property,
-        there is a docstring to be inserted,
-        the next line is a one-linner
-        """
-
-        if line.count(":") < 1 or not IndentTracker.property_name or not Docstring.text:
-            return line
-
-        if not any(
-            line.strip().startswith(colon_prefix)
-            for colon_prefix in Docstring.ONELINER_PREFIXES
-        ):
-            return line
-
-        if line.count(":") > 1:
-            print("ERROR: can not split oneliner", line)
-            raise SystemExit
-
-        line_one, line_two = line.split(":")
-
-        for each_line in (line_one, line_two):
-            if not each_line.strip():
-                return line
-
-        line_one += ":"
-        line_two = get_indent(line) + IndentTracker.one_indent + line_two.strip()
-
-        return "\n".join((line_one, line_two))
-
-
-def remove_one_indent(line):
-    return line.replace(IndentTracker.one_indent, "", 1)
-
-
-def get_indent(line):
-    indent_pos = len(line) - len(line.lstrip())
-    return line[:indent_pos]
-
-
-def convert_method_name(line, old_dunder_name):
-    """For `__get__` and the second line of `__set__` and `__del__`"""
-    modified_line = line.replace(old_dunder_name, IndentTracker.property_name)
-    modified_line = remove_one_indent(modified_line)
-    return modified_line
+def write_file(path, content):
+    path.parent.mkdir(
+        exist_ok=True, parents=True
+    )  # used only when output_mod_only = True
+    with open(path, "w") as f:
+        f.write(content)
 
 
-def create_decorator(line, old_dunder_name, new_name):
-    """For `__set__` and `__del__`"""
-    first_line = remove_one_indent(line)
-    first_line = f"{get_indent(first_line)}@{IndentTracker.property_name}.{new_name}"
-    second_line = convert_method_name(line, old_dunder_name)
+def get_rel_path_parts(file_path):
+    project_name_ind = file_path.parts.index(PROJECT_NAME)
+    return file_path.parts[project_name_ind:]
 
-    return "\n".join((first_line, second_line))
 
+def get_output_path(file_path):
+    return pathlib.Path(output_path).joinpath(*get_rel_path_parts(file_path))
 
-def first_pass(file_path):
-    modified_file_contents = ""
-    with open(file_path) as file:
-        for line_number, line in enumerate(file.read().splitlines(), 1):
-            IndentTracker.update_indent(line)
 
-            match_property(line)
-            match_docstring(line)
+def get_archive_name(file_path):
+    return "/".join(get_rel_path_parts(file_path))
 
-            IndentTracker.prevent_mixed_chars(line)
-            modified_line = Docstring.split_inline(line)
-            modified_line = no_getter(modified_line, line_number)
 
-            if isinstance(modified_line, str):
-                modified_file_contents = "\n".join(
-                    (modified_file_contents, modified_line)
-                )
+def copy_orig_dir():
+    if args.output_mod_only:
+        return
+    new_output_path = output_path.joinpath(PROJECT_NAME)
+    shutil.copytree(str(input_path), str(new_output_path), dirs_exist_ok=True)
 
-    write_file(get_output_path(file_path), modified_file_contents)
 
+def open_archive(path):
+    if path.suffix == ".zip":
+        return zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+    if path.name.endswith((".tar.gz", ".tgz")):
+        return tarfile.open(path, "w:gz")
+    if path.suffix == ".tar":
+        return tarfile.open(path, "w")
+    print(f"ERROR unknown archive type: {path}")
+    print("\n The archive must end with .tar, .tar.gz, .tgz or .zip\n")
+    raise SystemExit
 
-no_getter_skip_prop = []
 
+def archive_original(archive, file_path):
+    """Add an unmodified file or folder to the archive"""
+    if isinstance(archive, zipfile.ZipFile):
+        archive.write(file_path, get_archive_name(file_path))
+    else:
+        archive.add(file_path, get_archive_name(file_path), recursive=False)
 
-def no_getter(line, line_number):
-    """Setter and deleter methods must have a getter method"""
 
-    if line.strip().startswith("def __get__("):
-        IndentTracker.get_detect = True
+def archive_file(archive, file_path, content):
+    """Add the converted contents of `file_path` to the archive"""
+    data = content.encode()
+    # Keep the permissions and times of the original file, like archive_original()
+    if isinstance(archive, zipfile.ZipFile):
+        zip_info = zipfile.ZipInfo.from_file(file_path, get_archive_name(file_path))
+        archive.writestr(zip_info, data, compress_type=archive.compression)
+    else:
+        tar_info = archive.gettarinfo(file_path, get_archive_name(file_path))
+        tar_info.size = len(data)
+        archive.addfile(tar_info, io.BytesIO(data))
+
+
+def in_shard(file_path):
+    """Files are split between shards by a hash of the path relative to the input folder"""
+    if args.shard is None:
+        return True
+    index, count = args.shard
+    rel_path = file_path.relative_to(input_path).as_posix()
+    path_hash = int(hashlib.sha256(rel_path.encode()).hexdigest(), 16)
+    return path_hash % count == index - 1
+
+
+class ConversionCache:
+    """Converted files saved by a hash of their contents, the converter code and the options"""
+
+    def __init__(self, cache_dir, max_size):
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # Autocommit so that runs in other checkouts are never locked out for long
+        self.connection = sqlite3.connect(
+            cache_dir / "cache.sqlite", timeout=30, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS conversions (
+                key TEXT PRIMARY KEY,
+                contents TEXT NOT NULL,
+                modified INTEGER NOT NULL,
+                no_getter_skipped TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS conversions_last_used ON conversions (last_used)"
+        )
+
+        # Any change to the conversion code or options must miss the cache
+        with open(converter_core.__file__, "rb") as file:
+            core_hash = hashlib.sha256(file.read()).hexdigest()
+        self.key_prefix = f"{core_hash}:{args.class_declaration}:{args.no_getter}:"
+
+    def get_key(self, source):
+        source_hash = hashlib.sha256(source.encode()).hexdigest()
+        return hashlib.sha256((self.key_prefix + source_hash).encode()).hexdigest()
+
+    def convert(self, source):
+        """Same as convert_source(), but also return the properties skipped for having no getter"""
+        key = self.get_key(source)
+        row = self.connection.execute(
+            "SELECT contents, modified, no_getter_skipped FROM conversions WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is not None:
+            self.hits += 1
+            self.connection.execute(
+                "UPDATE conversions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            contents, file_modified, no_getter_skipped = row
+            return contents, bool(file_modified), json.loads(no_getter_skipped)
+
+        self.misses += 1
+        contents, file_modified = convert_source(source)
+        no_getter_skipped = list(dict.fromkeys(converter_core.no_getter_skip_prop))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                contents,
+                file_modified,
+                json.dumps(no_getter_skipped),
+                len(contents.encode()),
+                time.time(),
+            ),
+        )
+        return contents, file_modified, no_getter_skipped
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in max_size"""
+        (total_size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM conversions"
+        ).fetchone()
+        if total_size <= self.max_size:
+            return
 
-    if (
-        line.strip().startswith("def __set__(")
-        or line.strip().startswith("def __del__(")
-    ) and not IndentTracker.get_detect:
-        print("ERROR: `get` not detected", line, IndentTracker.property_name)
-        print(line_number)
-        # Create an empty getter
-        if args.no_getter == "convert":
-            line_one = f"{IndentTracker.property_indent}{IndentTracker.one_indent}def __get__(self):"
-            line_two = f"{IndentTracker.property_indent}{IndentTracker.one_indent}{IndentTracker.one_indent}pass"
-            return "\n".join((line_one, line_two, line))
-        else:
-            # raise SystemExit
-            no_getter_skip_prop.append(IndentTracker.property_name)
-    return line
-
-
-def match_class_name(line):
-    if line.strip().startswith("cdef class "):
-        if args.class_declaration == "pure_python":
-            return line.replace("cdef ", "@cython.cclass\n")
-    return line
-
-
-def match_property(line):
-    if line.strip().startswith("property "):
-        IndentTracker.property_indent = get_indent(line)
-        IndentTracker.property_name = line.split("property ")[1].split(":")[0]
-        IndentTracker.pause_insertions = True
-        IndentTracker.property_detect = "CURRENT_LINE"
-        if IndentTracker.property_name in no_getter_skip_prop:
-            IndentTracker.property_name = ""
+        evicted_keys = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM conversions ORDER BY last_used"
+        ).fetchall():
+            if total_size <= self.max_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            "DELETE FROM conversions WHERE key = ?", evicted_keys
+        )
+        self.connection.execute("COMMIT")
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+
+def new_report(shard=(1, 1)):
+    return {
+        "shard": list(shard),
+        "converted_files": 0,
+        "modified_files": [],
+        "no_getter_skipped": {},
+        "outputs": [],
+    }
+
+
+def convert_dir(archive=None, cache=None):
+    """Convert every .pyx and .pxi file in the input folder. Return a report of the run.
+    When an archive is given, everything is written into it instead of the output folder.
+    """
+    report = new_report(args.shard or (1, 1))
+    for file_path in pathlib.Path(input_path).glob("**/*"):
+        # The archive may be written inside the input folder
+        if archive is not None and file_path == archive_path:
+            continue
+        if file_path.suffix not in (".pyx", ".pxi"):
+            if archive is not None and not args.output_mod_only:
+                archive_original(archive, file_path)
+            continue
+        if not in_shard(file_path):
+            continue
+        print(f"Begin: {file_path}")
+
+        with open(file_path) as file:
+            source = file.read()
+        if cache is None:
+            modified_file_contents, file_modified = convert_source(source)
+            no_getter_skipped = list(dict.fromkeys(converter_core.no_getter_skip_prop))
         else:
-            return f"{get_indent(line)}@property"
-    return line
-
-
-def match_get(line):
-    if line.strip().startswith("def __get__("):
-        if IndentTracker.property_name:
-            # IndentTracker.get_detect = True
-            return convert_method_name(line, "__get__")
-    return line
-
-
-def match_set(line):
-    if line.strip().startswith("def __set__("):
-        if IndentTracker.property_name:
-            return create_decorator(line, "__set__", "setter")
-    return line
-
-
-def match_del(line):
-    if line.strip().startswith("def __del__("):
-        if IndentTracker.property_name:
-            return create_decorator(line, "__del__", "deleter")
-    return line
-
-
-def match_docstring(line):
-    if (
-        line.strip().startswith("'")
-        or line.strip().startswith('"')
-        or line.strip().startswith("#")
-    ) and IndentTracker.property_detect == "LINE_AFTER":
+            modified_file_contents, file_modified, no_getter_skipped = cache.convert(
+                source
+            )
 
-        if IndentTracker.property_name:
-
-            Docstring.new_docstring_detected(line)
-            return True
-
-
-def convert_line(line):
-    """Return empty when you want to exclude the line from the output file.
-    Such as when moving docstrings.
+        if archive is None:
+            output_file_path = str(get_output_path(file_path))
+            write_file(get_output_path(file_path), modified_file_contents)
+        else:
+            output_file_path = get_archive_name(file_path)
+            archive_file(archive, file_path, modified_file_contents)
+
+        report["converted_files"] += 1
+        if file_modified:
+            report["modified_files"].append(output_file_path)
+        if no_getter_skipped:
+            report["no_getter_skipped"][output_file_path] = no_getter_skipped
+
+    return report
+
+
+def check_shards(reports):
+    """Every shard of one split must be merged exactly once"""
+    shards = [report["shard"] for report in reports]
+    shard_counts = sorted({count for _, count in shards})
+    if len(shard_counts) > 1:
+        print(f"ERROR reports from different shard counts: {shard_counts}")
+        raise SystemExit(1)
+
+    indices = [index for index, _ in shards]
+    duplicates = sorted({index for index in indices if indices.count(index) > 1})
+    missing = sorted(set(range(1, shard_counts[0] + 1)) - set(indices))
+    if duplicates:
+        print(f"ERROR shards merged more than once: {duplicates}")
+    if missing:
+        print(f"ERROR shards missing out of {shard_counts[0]}: {missing}")
+    if duplicates or missing:
+        raise SystemExit(1)
+
+
+def merge_reports(reports):
+    check_shards(reports)
+    merged_report = new_report()
+    for report in reports:
+        merged_report["converted_files"] += report["converted_files"]
+        merged_report["modified_files"].extend(report["modified_files"])
+        merged_report["no_getter_skipped"].update(report["no_getter_skipped"])
+        for output in report["outputs"]:
+            if output not in merged_report["outputs"]:
+                merged_report["outputs"].append(output)
+    return merged_report
+
+
+def print_summary(report):
+    print("\n Modified files:")
+    for filename in sorted(report["modified_files"]):
+        print(filename)
+
+    if report["no_getter_skipped"]:
+        print("\n Properties kept in the old syntax because they have no getter:")
+        for filename, property_names in sorted(report["no_getter_skipped"].items()):
+            print(f"{filename}: {', '.join(property_names)}")
+
+    print(f"\n Number of converted files: {report['converted_files']}")
+
+    print(f"\n Number of modified files: {len(report['modified_files'])}")
+
+    for output in report["outputs"]:
+        print(f"\n Output {output['type']}: \n{output['path']}")
+
+
+def get_edits(source, modified_source):
+    """Describe the changes as replacements of line ranges.
+    `start` and `end` are zero-based line numbers of the original source, `end` is exclusive.
+    The new text uses the line ending of the original source.
     """
-
-    if Docstring.build_multi_line(line):
-        return
-
-    if not line.strip():
-        if (
-            Docstring.descriptor == "INSERT" or IndentTracker.pause_insertions
-        ):  # Remove extra newline
-            return
-        return line
-
-    if match_docstring(line):
-        return
-
-    IndentTracker.pause_insertions = False
-
-    modified_line = line
-
-    modified_line = match_class_name(modified_line)
-
-    modified_line = match_property(modified_line)
-
-    modified_line = match_get(modified_line)
-
-    modified_line = match_set(modified_line)
-
-    modified_line = match_del(modified_line)
-
-    # No matches
-    if modified_line == line:
-        if IndentTracker.property_name:
-            modified_line = remove_one_indent(line)
-
-    modified_line = Docstring.insert_docstring(modified_line)
-
-    return modified_line
-
-
-def write_file(path, content):
-    path.parent.mkdir(
-        exist_ok=True, parents=True
-    )  # used only when output_mod_only = True
-    content = content[1:]  # prevent extra newline at beginning
-    content = "\n".join((content, ""))  # replace missing newline at end
-    with open(path, "w") as f:
-        f.write(content)
-
-
-def get_output_path(file_path):
-    project_name_ind = file_path.parts.index(PROJECT_NAME)
-    rel_path_parts = file_path.parts[project_name_ind:]
-    return pathlib.Path(output_path).joinpath(*rel_path_parts)
-
-
-def copy_orig_dir():
-    if args.output_mod_only:
-        return
-    new_output_path = output_path.joinpath(PROJECT_NAME)
-    shutil.copytree(str(input_path), str(new_output_path), dirs_exist_ok=True)
+    newline = "\r\n" if "\r\n" in source else "\n"
+    source_lines = source.splitlines()
+    modified_lines = modified_source.splitlines()
+    matcher = difflib.SequenceMatcher(
+        None, source_lines, modified_lines, autojunk=False
+    )
+    return [
+        {
+            "start": i1,
+            "end": i2,
+            "text": "".join(line + newline for line in modified_lines[j1:j2]),
+        }
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def rpc_convert_source(params):
+    modified_source, file_modified = convert_source(params["source"])
+    return {"text": modified_source, "modified": file_modified}
+
+
+def rpc_check(params):
+    source = params["source"]
+    modified_source, file_modified = convert_source(source)
+    if not file_modified:
+        return {"modified": False, "edits": []}
+    return {"modified": True, "edits": get_edits(source, modified_source)}
+
+
+def rpc_convert_file(params):
+    """Convert `path`. Also save the result when `output_path` is given."""
+    with open(params["path"]) as file:
+        modified_source, file_modified = convert_source(file.read())
+    if params.get("output_path"):
+        write_file(pathlib.Path(params["output_path"]), modified_source)
+    return {"text": modified_source, "modified": file_modified}
+
+
+RPC_METHODS = {
+    "convert_source": rpc_convert_source,
+    "check": rpc_check,
+    "convert_file": rpc_convert_file,
+}
+
+
+def rpc_error(request_id, code, message):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": code, "message": message},
+    }
+
+
+def handle_request(request):
+    """Return the JSON-RPC response for one decoded request"""
+    if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+        return rpc_error(None, -32600, "Invalid Request")
+
+    request_id = request.get("id")
+    method = RPC_METHODS.get(request["method"])
+    if method is None:
+        return rpc_error(request_id, -32601, f"Method not found: {request['method']}")
+
+    params = request.get("params", {})
+    if not isinstance(params, dict):
+        return rpc_error(request_id, -32602, "Invalid params: expected an object")
+
+    # Conversion messages must not be mixed into the responses
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            result = method(params)
+    except KeyError as e:
+        return rpc_error(request_id, -32602, f"Invalid params: missing {e}")
+    except SystemExit:
+        # The converter prints the reason before it stops
+        reason = " ".join(messages.getvalue().split())
+        return rpc_error(request_id, -32000, f"Conversion failed: {reason}")
+    except Exception as e:
+        return rpc_error(request_id, -32000, f"Conversion failed: {e!r}")
+    finally:
+        sys.stderr.write(messages.getvalue())
+
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+def serve():
+    """Answer one JSON-RPC request per line of stdin until `shutdown` or end of input.
+    Requests without an `id` are notifications and get no response.
+    """
+    for request_line in sys.stdin:
+        if not request_line.strip():
+            continue
+
+        try:
+            request = json.loads(request_line)
+        except json.JSONDecodeError:
+            response = rpc_error(None, -32700, "Parse error")
+        else:
+            if isinstance(request, dict) and request.get("method") == "shutdown":
+                if "id" in request:
+                    print(
+                        json.dumps(
+                            {"jsonrpc": "2.0", "id": request["id"], "result": None}
+                        ),
+                        flush=True,
+                    )
+                return
+            response = handle_request(request)
+            if isinstance(request, dict) and "id" not in request:
+                continue
+
+        print(json.dumps(response), flush=True)
 
 
 args = setup_parser()
@@ -420,51 +544,50 @@ if args.output_dir == "DEFAULT":
 else:
     output_path = pathlib.Path(args.output_dir)
 
-copy_orig_dir()
-
-
-for file_path in pathlib.Path(input_path).glob("**/*"):
-    if file_path.suffix not in (".pyx", ".pxi"):
-        continue
-    print(f"Begin1: {file_path}")
-
-    with open(file_path) as file:
-        first_pass(file_path)
-
-
-modified_files = []
-for file_path in pathlib.Path(output_path).glob("**/*"):
-    if file_path.suffix not in (".pyx", ".pxi"):
-        continue
-    print(f"Begin2: {file_path}")
-
-    file_modified = False
-    modified_file_contents = ""
-
-    with open(file_path) as file:
-        Docstring.text = ""
-        Docstring.descriptor = ""
-        for line_number, line in enumerate(file.read().splitlines(), 1):
-            IndentTracker.update_indent(line)
-            modified_line = convert_line(line)
-
-            if isinstance(modified_line, str):
-                modified_file_contents = "\n".join(
-                    (modified_file_contents, modified_line)
-                )
-
-            if line != modified_line:
-                file_modified = True
-
-    if file_modified:
-        modified_files.append(file_path)
-        write_file(get_output_path(file_path), modified_file_contents)
-
-
-print("\n Modified files:")
-for filename in modified_files:
-    print(filename)
-
-print(f"\n Number of modified files: {len(modified_files)}")
-
-print(f"\n Output directory: \n{output_path.resolve()}")
+converter_core.Options.class_declaration = args.class_declaration
+converter_core.Options.no_getter = args.no_getter
+
+if args.server:
+    serve()
+    raise SystemExit
+
+if args.merge_reports:
+    reports = []
+    for report_path in args.merge_reports:
+        with open(report_path) as file:
+            reports.append(json.load(file))
+    print_summary(merge_reports(reports))
+    raise SystemExit
+
+cache = None
+if args.cache:
+    if args.cache_dir:
+        cache_dir = pathlib.Path(args.cache_dir)
+    else:
+        cache_dir = get_default_cache_dir()
+    cache = ConversionCache(cache_dir, args.cache_size * 1024 * 1024)
+
+try:
+    if args.output_archive:
+        archive_path = pathlib.Path(args.output_archive).resolve()
+        archive_path.parent.mkdir(exist_ok=True, parents=True)
+        with open_archive(archive_path) as archive:
+            report = convert_dir(archive, cache)
+        report["outputs"].append({"type": "archive", "path": str(archive_path)})
+    else:
+        copy_orig_dir()
+        report = convert_dir(cache=cache)
+        report["outputs"].append(
+            {"type": "directory", "path": str(output_path.resolve())}
+        )
+finally:
+    if cache is not None:
+        cache.close()
+
+if args.report:
+    write_file(pathlib.Path(args.report), json.dumps(report, indent=4))
+
+print_summary(report)
+
+if cache is not None:
+    print(f"\n Cache hits: {cache.hits} of {cache.hits + cache.misses}")
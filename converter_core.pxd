@@ -0,0 +1,18 @@
+# Type declarations used only when converter_core.py is compiled with cythonize.
+
+cpdef str remove_one_indent(str line)
+cpdef str get_indent(str line)
+cpdef str convert_method_name(str line, str old_dunder_name)
+cpdef str create_decorator(str line, str old_dunder_name, str new_name)
+cpdef list first_pass(str source)
+cpdef tuple second_pass(str source)
+cpdef str join_lines(list lines)
+cpdef tuple convert_source(str source)
+cpdef str no_getter(str line, Py_ssize_t line_number)
+cpdef str match_class_name(str line)
+cpdef str match_property(str line)
+cpdef str match_get(str line)
+cpdef str match_set(str line)
+cpdef str match_del(str line)
+cpdef object match_docstring(str line)
+cpdef object convert_line(str line)
@@ -0,0 +1,385 @@
+"""The line by line property conversion.
+
+Kept apart from the command line script so it can be compiled as an optional accelerator:
+`cythonize -i -3 converter_core.py`
+The compiled module is imported instead of this file when it exists next to it.
+"""
+
+
+class Options:
+    """Command line options used by the conversion"""
+
+    class_declaration = "cython"
+    no_getter = "skip"
+
+
+class IndentTracker:
+    """All code in a property block must have its indent reduced by 1 when converting."""
+
+    prev_indent = ""
+    current_indent = ""
+    one_indent = ""
+    property_indent = ""
+    property_name = ""
+    pause_insertions = False  # Prevent newlines immediately after property decorator
+    property_detect = ""  # Move docstrings only if immediately after property decorator
+    get_detect = False  # Prevent setter and deleter methods if getter doesn't exist
+
+    def update_indent(line):
+        if not line.strip():
+            return
+
+        Docstring.update_property_detect()
+
+        IndentTracker.current_indent = get_indent(line)
+
+        # Increase detected
+        if len(IndentTracker.current_indent) > len(IndentTracker.prev_indent):
+
+            # First indent detected
+            if len(IndentTracker.prev_indent) == 0:
+                IndentTracker.one_indent = IndentTracker.current_indent
+
+        # End of property block detected
+        if len(IndentTracker.current_indent) <= len(IndentTracker.property_indent):
+            IndentTracker.property_name = ""
+            IndentTracker.pause_insertions = False
+            IndentTracker.get_detect = False
+
+        # Always set prev to current
+        IndentTracker.prev_indent = IndentTracker.current_indent
+
+    def prevent_mixed_chars(line, line_number):
+        """Prevent use of mixed spaces and tabs in an indent"""
+        indent = get_indent(line)
+        if " " in indent and "\t" in indent:
+            print(f"ERROR mixed indent on line number {line_number}: {repr(line)}")
+            print(f"\n An indent must not contain both tabs and spaces.\n")
+            raise SystemExit
+
+        if len(indent) > 0 and len(IndentTracker.property_indent) > 0:
+            if indent[0] != IndentTracker.property_indent[0]:
+                print()
+                # print(3333333333, " ".join(str(ord(char)) for char in indent))
+
+
+class Docstring:
+    """A docstring for a property must be saved and moved to after a def statement"""
+
+    ONELINER_PREFIXES = (
+        "if ",
+        "elif ",
+        "else",
+        "for ",
+        "while ",
+        "def ",
+        "cdef ",
+        "cpdef ",
+        "class ",
+        "try",
+        "except",
+        "finally",
+    )  # all one-liners must start with one of these
+    DELIM_CHARS = ("'''", '"""', "'", '"', "#")
+
+    text = ""
+    descriptor = ""
+    delim_char = None
+
+    def new_docstring_detected(line):
+        Docstring.text = line
+
+        ## change to line.strip()[:3]?
+        # Set quote style
+        for delim_char in Docstring.DELIM_CHARS:
+            if line.strip().startswith(delim_char):
+                Docstring.delim_char = delim_char
+                break
+        else:
+            print("ERROR docstring", line)
+
+        ## change to line.strip().endswith(Docstring.delim_char)?
+        # One line docstring
+        if line.count(Docstring.delim_char) > 1 or delim_char == "#":
+            Docstring.descriptor = "INSERT"
+        # Begin multi line docstring
+        else:
+            Docstring.descriptor = "MULTI_LINE_IN_PROGRESS"
+
+    def insert_docstring(line):
+        if Docstring.descriptor != "INSERT":
+            return line
+
+        modified_line = "\n".join((line, Docstring.text))
+
+        Docstring.text = ""
+        Docstring.descriptor = ""
+        return modified_line
+
+    def build_multi_line(line):
+        """Combine all docstring lines. Return True while collecting multiline docstring"""
+        if Docstring.descriptor == "MULTI_LINE_IN_PROGRESS":
+            Docstring.text = "\n".join((Docstring.text, line))
+            if line.strip().endswith(Docstring.delim_char):
+                Docstring.descriptor = "INSERT"
+            return True
+
+    def update_property_detect():
+        "Detect the line after the property keyword"
+        if IndentTracker.property_detect == "CURRENT_LINE":
+            IndentTracker.property_detect = "LINE_AFTER"
+        else:
+            IndentTracker.property_detect = ""
+
+    def split_inline(line):
+        """Must split combined one line statements when trying to insert a doctstring.
+        Example: `def __get__(self): return self.index`
+
+        Only split the line when all true:
+        inside a property,
+        there is a docstring to be inserted,
+        the next line is a one-linner
+        """
+
+        if line.count(":") < 1 or not IndentTracker.property_name or not Docstring.text:
+            return line
+
+        if not any(
+            line.strip().startswith(colon_prefix)
+            for colon_prefix in Docstring.ONELINER_PREFIXES
+        ):
+            return line
+
+        if line.count(":") > 1:
+            print("ERROR: can not split oneliner", line)
+            raise SystemExit
+
+        line_one, line_two = line.split(":")
+
+        for each_line in (line_one, line_two):
+            if not each_line.strip():
+                return line
+
+        line_one += ":"
+        line_two = get_indent(line) + IndentTracker.one_indent + line_two.strip()
+
+        return "\n".join((line_one, line_two))
+
+
+def remove_one_indent(line):
+    return line.replace(IndentTracker.one_indent, "", 1)
+
+
+def get_indent(line):
+    indent_pos = len(line) - len(line.lstrip())
+    return line[:indent_pos]
+
+
+def convert_method_name(line, old_dunder_name):
+    """For `__get__` and the second line of `__set__` and `__del__`"""
+    modified_line = line.replace(old_dunder_name, IndentTracker.property_name)
+    modified_line = remove_one_indent(modified_line)
+    return modified_line
+
+
+def create_decorator(line, old_dunder_name, new_name):
+    """For `__set__` and `__del__`"""
+    first_line = remove_one_indent(line)
+    first_line = f"{get_indent(first_line)}@{IndentTracker.property_name}.{new_name}"
+    second_line = convert_method_name(line, old_dunder_name)
+
+    return "\n".join((first_line, second_line))
+
+
+def first_pass(source):
+    """Split one-liners and find properties without a getter. Return the lines."""
+    modified_lines = []
+    for line_number, line in enumerate(source.splitlines(), 1):
+        IndentTracker.update_indent(line)
+
+        match_property(line)
+        match_docstring(line)
+
+        IndentTracker.prevent_mixed_chars(line, line_number)
+        modified_line = Docstring.split_inline(line)
+        modified_line = no_getter(modified_line, line_number)
+
+        if isinstance(modified_line, str):
+            modified_lines.append(modified_line)
+
+    return modified_lines
+
+
+def second_pass(source):
+    """Convert each line. Return the lines and whether any line was modified."""
+    file_modified = False
+    modified_lines = []
+
+    Docstring.text = ""
+    Docstring.descriptor = ""
+    for line in source.splitlines():
+        IndentTracker.update_indent(line)
+        modified_line = convert_line(line)
+
+        if isinstance(modified_line, str):
+            modified_lines.append(modified_line)
+
+        if line != modified_line:
+            file_modified = True
+
+    return modified_lines, file_modified
+
+
+def reset_state():
+    """Forget everything learned from the previous file"""
+    IndentTracker.prev_indent = ""
+    IndentTracker.current_indent = ""
+    IndentTracker.one_indent = ""
+    IndentTracker.property_indent = ""
+    IndentTracker.property_name = ""
+    IndentTracker.pause_insertions = False
+    IndentTracker.property_detect = ""
+    IndentTracker.get_detect = False
+    Docstring.text = ""
+    Docstring.descriptor = ""
+    Docstring.delim_char = None
+    no_getter_skip_prop.clear()
+
+
+def join_lines(lines):
+    return "\n".join(lines) + "\n"
+
+
+def convert_source(source):
+    """Convert the contents of one file.
+    Return the new contents and whether the property conversion modified them.
+    """
+    reset_state()
+    first_pass_contents = join_lines(first_pass(source))
+    modified_lines, file_modified = second_pass(first_pass_contents)
+    if file_modified:
+        return join_lines(modified_lines), True
+    return first_pass_contents, False
+
+
+no_getter_skip_prop = []
+
+
+def no_getter(line, line_number):
+    """Setter and deleter methods must have a getter method"""
+
+    if line.strip().startswith("def __get__("):
+        IndentTracker.get_detect = True
+
+    if (
+        line.strip().startswith("def __set__(")
+        or line.strip().startswith("def __del__(")
+    ) and not IndentTracker.get_detect:
+        print("ERROR: `get` not detected", line, IndentTracker.property_name)
+        print(line_number)
+        # Create an empty getter
+        if Options.no_getter == "convert":
+            line_one = f"{IndentTracker.property_indent}{IndentTracker.one_indent}def __get__(self):"
+            line_two = f"{IndentTracker.property_indent}{IndentTracker.one_indent}{IndentTracker.one_indent}pass"
+            return "\n".join((line_one, line_two, line))
+        else:
+            # raise SystemExit
+            no_getter_skip_prop.append(IndentTracker.property_name)
+    return line
+
+
+def match_class_name(line):
+    if line.strip().startswith("cdef class "):
+        if Options.class_declaration == "pure_python":
+            return line.replace("cdef ", "@cython.cclass\n")
+    return line
+
+
+def match_property(line):
+    if line.strip().startswith("property "):
+        IndentTracker.property_indent = get_indent(line)
+        IndentTracker.property_name = line.split("property ")[1].split(":")[0]
+        IndentTracker.pause_insertions = True
+        IndentTracker.property_detect = "CURRENT_LINE"
+        if IndentTracker.property_name in no_getter_skip_prop:
+            IndentTracker.property_name = ""
+        else:
+            return f"{get_indent(line)}@property"
+    return line
+
+
+def match_get(line):
+    if line.strip().startswith("def __get__("):
+        if IndentTracker.property_name:
+            # IndentTracker.get_detect = True
+            return convert_method_name(line, "__get__")
+    return line
+
+
+def match_set(line):
+    if line.strip().startswith("def __set__("):
+        if IndentTracker.property_name:
+            return create_decorator(line, "__set__", "setter")
+    return line
+
+
+def match_del(line):
+    if line.strip().startswith("def __del__("):
+        if IndentTracker.property_name:
+            return create_decorator(line, "__del__", "deleter")
+    return line
+
+
+def match_docstring(line):
+    if (
+        line.strip().startswith("'")
+        or line.strip().startswith('"')
+        or line.strip().startswith("#")
+    ) and IndentTracker.property_detect == "LINE_AFTER":
+
+        if IndentTracker.property_name:
+
+            Docstring.new_docstring_detected(line)
+            return True
+
+
+def convert_line(line):
+    """Return empty when you want to exclude the line from the output file.
+    Such as when moving docstrings.
+    """
+
+    if Docstring.build_multi_line(line):
+        return
+
+    if not line.strip():
+        if (
+            Docstring.descriptor == "INSERT" or IndentTracker.pause_insertions
+        ):  # Remove extra newline
+            return
+        return line
+
+    if match_docstring(line):
+        return
+
+    IndentTracker.pause_insertions = False
+
+    modified_line = line
+
+    modified_line = match_class_name(modified_line)
+
+    modified_line = match_property(modified_line)
+
+    modified_line = match_get(modified_line)
+
+    modified_line = match_set(modified_line)
+
+    modified_line = match_del(modified_line)
+
+    # No matches
+    if modified_line == line:
+        if IndentTracker.property_name:
+            modified_line = remove_one_indent(line)
+
+    modified_line = Docstring.insert_docstring(modified_line)
+
+    return modified_line
@@ -0,0 +1,127 @@
+"""Compare the pure Python and the compiled conversion core on a generated corpus.
+
+Build the compiled core first: `cythonize -i -3 converter_core.py`
+Then run: `python tests/benchmark.py`
+"""
+
+import argparse
+import contextlib
+import importlib.machinery
+import importlib.util
+import io
+import time
+from pathlib import Path
+
+
+base_path = Path(__file__).parent.parent
+
+PROPERTY_TEMPLATES = (
+    """    property value_{n}:
+        "Docstring for value_{n}"
+        def __get__(self):
+            return self._value_{n}
+        def __set__(self, value):
+            self._value_{n} = value
+        def __del__(self):
+            self._value_{n} = None
+""",
+    """    property split_{n}:
+        "docstring for split_{n}"
+        def __get__(self): return self._split_{n}
+""",
+    """    property multi_{n}:
+        \"\"\"First line of the docstring for multi_{n}
+
+        More details.
+        \"\"\"
+
+        def __get__(self):
+            if self._multi_{n}:
+                return self._multi_{n}
+            return 0
+""",
+    """    cdef int plain_{n}(self):
+        return {n}
+""",
+)
+
+
+def generate_file(file_number, classes, properties):
+    parts = []
+    for class_number in range(classes):
+        parts.append(f"cdef class Spam_{file_number}_{class_number}:\n")
+        for n in range(properties):
+            parts.append(PROPERTY_TEMPLATES[n % len(PROPERTY_TEMPLATES)].format(n=n))
+        parts.append("\n")
+    return "".join(parts)
+
+
+def load_core(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_compiled_core():
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        path = base_path / f"converter_core{suffix}"
+        if path.exists():
+            return path
+
+
+def run(core, corpus, repeat):
+    """Return the best time to convert the whole corpus"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for source in corpus:
+            core.convert_source(source)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--classes", type=int, default=5)
+    parser.add_argument("--properties", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = [
+        generate_file(i, args.classes, args.properties) for i in range(args.files)
+    ]
+    line_count = sum(source.count("\n") for source in corpus)
+    print(f"Corpus: {len(corpus)} files, {line_count} lines")
+
+    cores = {
+        "pure python": load_core(base_path / "converter_core.py", "converter_core")
+    }
+    compiled_path = find_compiled_core()
+    if compiled_path is None:
+        print(
+            "No compiled core found. Build it with `cythonize -i -3 converter_core.py`"
+        )
+    else:
+        cores["compiled"] = load_core(compiled_path, "converter_core")
+
+    outputs = []
+    results = {}
+    for name, core in cores.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs.append([core.convert_source(source) for source in corpus])
+            results[name] = run(core, corpus, args.repeat)
+        print(
+            f"{name:>12}: {results[name]:.3f} s  {line_count / results[name]:,.0f} lines/s"
+        )
+
+    if len(outputs) > 1:
+        assert outputs[0] == outputs[1], "compiled core output differs"
+        print(f"     speedup: {results['pure python'] / results['compiled']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
 import os
+import json
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import zipfile
 import pytest
 from pathlib import Path
 
@@ -17,6 +23,31 @@ def test_compilation():
     assert exit_code == 0
 
 
+def test_compiled_core(tmp_path):
+    for name in ("converter.py", "converter_core.py", "converter_core.pxd"):
+        shutil.copy(base_path / name, tmp_path)
+    exit_code = os.system(
+        f"cd {tmp_path} && python3 -m Cython.Build.Cythonize -i -3 converter_core.py"
+    )
+    assert exit_code == 0
+
+    # The compiled module must be imported instead of converter_core.py
+    exit_code = os.system(
+        f"cd {tmp_path} && python3 -c \"import converter_core; assert not converter_core.__file__.endswith('.py')\""
+    )
+    assert exit_code == 0
+
+    test_output = tmp_path / "test_output"
+    exit_code = os.system(
+        f"python3 {tmp_path}/converter.py -i {test_path}/input -o {test_output}"
+    )
+    assert exit_code == 0
+    with open(f"{test_path}/good_outputs/cython.py") as fff:
+        good = fff.read()
+    with open(f"{test_output}/input/trouble.pyx") as fff:
+        assert fff.read() == good
+
+
 class TestArgs:
     def test_class_declaration(self, tmp_path):
         test_output = tmp_path / "test_output"
@@ -52,4 +83,273 @@ class TestArgs:
                 for index, line in enumerate(fff.read().splitlines()):
                     assert line == good.splitlines()[index]
 
+    def test_output_archive(self, tmp_path):
+        test_input = tmp_path / "input"
+        shutil.copytree(f"{test_path}/input", test_input)
+        (test_input / "notes.txt").write_text("untouched")
+        with open(f"{test_path}/good_outputs/cython.py") as fff:
+            good = fff.read()
+
+        for archive_name in ("out.tar", "out.tar.gz", "out.zip"):
+            archive_path = tmp_path / archive_name
+            os.system(
+                f"python3 {base_path}/converter.py -i {test_input} -a {archive_path}"
+            )
+            if archive_name.endswith(".zip"):
+                with zipfile.ZipFile(archive_path) as archive:
+                    converted = archive.read("input/trouble.pyx").decode()
+                    original = archive.read("input/notes.txt").decode()
+            else:
+                with tarfile.open(archive_path) as archive:
+                    converted = archive.extractfile("input/trouble.pyx").read().decode()
+                    original = archive.extractfile("input/notes.txt").read().decode()
+
+            assert converted == good
+            assert original == "untouched"
+
+    def test_output_archive_inside_input(self, tmp_path):
+        test_input = tmp_path / "input"
+        test_input.mkdir()
+        shutil.copy(f"{test_path}/input/trouble.pyx", test_input)
+        os.chmod(test_input / "trouble.pyx", 0o755)
+        source_stat = os.stat(test_input / "trouble.pyx")
+
+        archive_path = test_input / "out.tar"
+        os.system(f"python3 {base_path}/converter.py -i {test_input} -a {archive_path}")
+        with tarfile.open(archive_path) as archive:
+            assert archive.getnames() == ["input/trouble.pyx"]
+            converted = archive.getmember("input/trouble.pyx")
+        assert converted.mode == source_stat.st_mode & 0o7777
+        assert int(converted.mtime) == int(source_stat.st_mtime)
+
+        archive_path = test_input / "out.zip"
+        os.system(f"python3 {base_path}/converter.py -i {test_input} -a {archive_path}")
+        with zipfile.ZipFile(archive_path) as archive:
+            assert sorted(archive.namelist()) == ["input/out.tar", "input/trouble.pyx"]
+
+    def test_shard(self, tmp_path):
+        test_input = tmp_path / "input"
+        (test_input / "sub").mkdir(parents=True)
+        for index in range(10):
+            shutil.copy(f"{test_path}/input/trouble.pyx", test_input / f"f{index}.pyx")
+            shutil.copy(
+                f"{test_path}/input/trouble.pyx", test_input / "sub" / f"g{index}.pxi"
+            )
+        test_output = tmp_path / "test_output"
+
+        def summary(*converter_args):
+            completed = subprocess.run(
+                ["python3", f"{base_path}/converter.py", *converter_args],
+                capture_output=True,
+                text=True,
+            )
+            return completed.stdout[completed.stdout.index("\n Modified files:") :]
+
+        unsharded = summary("-i", str(test_input), "-o", str(test_output))
+
+        shard_count = 3
+        report_paths = []
+        for index in range(1, shard_count + 1):
+            report_path = str(tmp_path / f"report{index}.json")
+            report_paths.append(report_path)
+            summary(
+                "-i",
+                str(test_input),
+                "-o",
+                str(test_output),
+                "--shard",
+                f"{index}/{shard_count}",
+                "--report",
+                report_path,
+            )
+
+        converted = []
+        for report_path in report_paths:
+            with open(report_path) as fff:
+                converted.append(json.load(fff)["converted_files"])
+        assert sum(converted) == 20
+        assert all(0 < count < 20 for count in converted)
+
+        assert summary("--merge_reports", *report_paths) == unsharded
+
+    def test_merge_reports_checks_shards(self, tmp_path):
+        def merge(*shards):
+            report_paths = []
+            for number, (index, count) in enumerate(shards):
+                report_path = tmp_path / f"report{number}.json"
+                report = {
+                    "shard": [index, count],
+                    "converted_files": 1,
+                    "modified_files": [f"f{index}.pyx"],
+                    "no_getter_skipped": {},
+                    "outputs": [],
+                }
+                report_path.write_text(json.dumps(report))
+                report_paths.append(str(report_path))
+            return subprocess.run(
+                [
+                    "python3",
+                    f"{base_path}/converter.py",
+                    "--merge_reports",
+                    *report_paths,
+                ],
+                capture_output=True,
+                text=True,
+            )
+
+        assert merge((1, 2), (2, 2)).returncode == 0
+
+        duplicated = merge((1, 2), (1, 2), (2, 2))
+        assert duplicated.returncode == 1
+        assert "ERROR shards merged more than once: [1]" in duplicated.stdout
+
+        missing = merge((1, 3), (3, 3))
+        assert missing.returncode == 1
+        assert "ERROR shards missing out of 3: [2]" in missing.stdout
+
+        mismatched = merge((1, 3), (2, 4))
+        assert mismatched.returncode == 1
+        assert "different shard counts" in mismatched.stdout
+
+    def test_cache(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        with open(f"{test_path}/good_outputs/cython.py") as fff:
+            good = fff.read()
+
+        outputs = []
+        for run in range(2):
+            test_output = tmp_path / f"test_output{run}"
+            completed = subprocess.run(
+                [
+                    "python3",
+                    f"{base_path}/converter.py",
+                    *("-i", f"{test_path}/input", "-o", str(test_output)),
+                    *("--cache", "--cache_dir", str(cache_dir)),
+                ],
+                capture_output=True,
+                text=True,
+            )
+            outputs.append(completed.stdout)
+            with open(f"{test_output}/input/trouble.pyx") as fff:
+                assert fff.read() == good
+
+        assert "Cache hits: 0 of 1" in outputs[0]
+        assert "Cache hits: 1 of 1" in outputs[1]
+
+        os.system(
+            f"python3 {base_path}/converter.py -i {test_path}/input -o {tmp_path}/test_output2 --cache --cache_dir {cache_dir} --cache_size 0"
+        )
+        connection = sqlite3.connect(cache_dir / "cache.sqlite")
+        assert connection.execute("SELECT COUNT(*) FROM conversions").fetchone() == (0,)
+        connection.close()
+
     def output_mod_only(self): ...
+
+
+class TestServer:
+    def run_server(self, requests):
+        lines = "".join(json.dumps(request) + "\n" for request in requests)
+        completed = subprocess.run(
+            ["python3", f"{base_path}/converter.py", "--server"],
+            input=lines,
+            capture_output=True,
+            text=True,
+        )
+        return [json.loads(line) for line in completed.stdout.splitlines()]
+
+    def test_convert_source(self):
+        with open(f"{test_path}/input/trouble.pyx") as fff:
+            source = fff.read()
+        with open(f"{test_path}/good_outputs/cython.py") as fff:
+            good = fff.read()
+
+        requests = [
+            {
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "convert_source",
+                "params": {"source": source},
+            },
+            {
+                "jsonrpc": "2.0",
+                "id": 2,
+                "method": "convert_source",
+                "params": {"source": source},
+            },
+            {"jsonrpc": "2.0", "id": 3, "method": "check", "params": {"source": good}},
+            {"jsonrpc": "2.0", "id": 4, "method": "missing"},
+            {"jsonrpc": "2.0", "id": 5, "method": "shutdown"},
+        ]
+        responses = self.run_server(requests)
+
+        assert [response["id"] for response in responses] == [1, 2, 3, 4, 5]
+        assert responses[0]["result"]["text"] == good
+        assert responses[1]["result"]["text"] == good
+        assert responses[2]["result"] == {"modified": False, "edits": []}
+        assert responses[3]["error"]["code"] == -32601
+
+    def test_check_edits(self):
+        source = "cdef class Spam:\n    property cheese:\n        def __get__(self):\n            return 1\n"
+        responses = self.run_server(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": 1,
+                    "method": "check",
+                    "params": {"source": source},
+                }
+            ]
+        )
+        edits = responses[0]["result"]["edits"]
+
+        lines = source.splitlines(keepends=True)
+        for edit in reversed(edits):
+            lines[edit["start"] : edit["end"]] = [edit["text"]]
+        assert (
+            "".join(lines)
+            == "cdef class Spam:\n    @property\n    def cheese(self):\n        return 1\n"
+        )
+
+    def test_check_crlf(self):
+        source = "cdef class Spam:\r\n    x = 1\r\n    property cheese:\r\n        def __get__(self):\r\n            return 1\r\n    y = 2\r\n"
+        responses = self.run_server(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": 1,
+                    "method": "check",
+                    "params": {"source": source},
+                }
+            ]
+        )
+        assert responses[0]["result"]["edits"] == [
+            {
+                "start": 2,
+                "end": 5,
+                "text": "    @property\r\n    def cheese(self):\r\n        return 1\r\n",
+            }
+        ]
+
+    def test_check_no_final_newline(self):
+        requests = [
+            {"jsonrpc": "2.0", "id": 1, "method": "check", "params": {"source": source}}
+            for source in ("x = 1", "cdef class Spam:\r\n    x = 1")
+        ]
+        for response in self.run_server(requests):
+            assert response["result"] == {"modified": False, "edits": []}
+
+    def test_conversion_error(self):
+        source = "cdef class Spam:\n    property cheese:\n\t  def __get__(self):\n            return 1\n"
+        responses = self.run_server(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": 1,
+                    "method": "check",
+                    "params": {"source": source},
+                }
+            ]
+        )
+        message = responses[0]["error"]["message"]
+        assert "mixed indent on line number 3" in message
+        assert "must not contain both tabs and spaces" in message